@@ -2,10 +2,18 @@
 import signal
 import sys
 import os
+import stat
 import argparse
 import subprocess
 import time
 import math
+import re
+import bisect
+import socket
+import struct
+import mmap
+import threading
+import array
 from collections import namedtuple
 
 import gi
@@ -60,10 +68,334 @@ def get_mem_usage(pid):
         return MemoryUsage(virt, rss)
 
 
+class SmapsReader(object):
+    """Sum up the RSS of a process by mapping kind from /proc/PID/smaps.
+
+    Every mapping is classified once, when it first shows up: the result is
+    cached under the mapping's header line (address range, permissions,
+    offset, device, inode and path), so later reads only need to pick out the
+    Rss of each mapping and add it to the right group.  Mappings that went
+    away are dropped from the cache.
+
+    group_by can be 'category' (heap, stack, anon, shmem, file, other) or
+    'file', which splits the 'file' category by the mapped file name.
+    """
+
+    # these start with a literal '\n' rather than using re.M and '^', which
+    # makes them several times faster on the tens of megabytes of smaps you
+    # get from processes with lots of mappings
+    HEADER_RE = re.compile(rb'\n([0-9a-f]+-[0-9a-f]+ [^\n]*)')
+    RSS_RE = re.compile(rb'\nRss: +(\d+)')
+
+    def __init__(self, pid, group_by='category'):
+        if group_by not in ('category', 'file'):
+            raise ValueError('group_by must be "category" or "file"')
+        self.pid = pid
+        self.group_by = group_by
+        self.groups = {}
+
+    def read(self):
+        """Return a {group: rss_in_kb} dict, or None if the process is gone."""
+        try:
+            with open('/proc/%d/smaps' % self.pid, 'rb') as f:
+                buf = b'\n' + f.read()
+        except IOError:
+            return None
+        if buf == b'\n':
+            return None
+        # the kernel writes out each mapping in one piece, so the headers and
+        # Rss lines always pair up
+        headers = self.HEADER_RE.findall(buf)
+        sizes = self.RSS_RE.findall(buf)
+        cache = self.groups
+        groups = {}
+        totals = {}
+        prev = None
+        for header, rss in zip(headers, sizes):
+            group = cache.get(header)
+            if group is None:
+                group = self._classify(header, prev)
+            groups[header] = group
+            totals[group] = totals.get(group, 0) + int(rss)
+            prev = header
+        self.groups = groups
+        return totals
+
+    def _classify(self, header, prev):
+        fields = header.split(None, 5)
+        path = fields[5].strip() if len(fields) > 5 else b''
+        if path == b'[heap]':
+            return 'heap'
+        if path.startswith(b'[stack'):
+            return 'stack'
+        if path.startswith(b'['):
+            return 'other'
+        if path.startswith(b'/dev/zero'):
+            # shared anonymous memory, i.e. mmap(MAP_SHARED | MAP_ANONYMOUS)
+            path = b''
+        if not path:
+            # a guess: glibc puts a guard page right below each thread stack
+            if prev is not None and fields[1].startswith(b'rw'):
+                prev_fields = prev.split(None, 5)
+                prev_end = prev_fields[0].partition(b'-')[2]
+                if (len(prev_fields) == 5 and prev_fields[1] == b'---p'
+                        and prev_end == fields[0].partition(b'-')[0]):
+                    return 'stack'
+            return 'anon'
+        if path.startswith((b'/memfd:', b'/SYSV', b'/dev/shm/')):
+            return 'shmem'
+        if path.endswith(b' (deleted)') and fields[3].startswith(b'00:'):
+            # most likely an unlinked tmpfs file
+            return 'shmem'
+        if self.group_by == 'file':
+            return path.decode('UTF-8', 'replace')
+        return 'file'
+
+
+Marker = namedtuple('Marker', 'time, label')
+
+
+class MarkerChannel(object):
+    """Receive event markers from a Unix datagram socket.
+
+    Each datagram is a short UTF-8 label, optionally preceded by '@', a Unix
+    timestamp (as returned by time.time()) and a space, e.g.
+    '@1500000000.25 cache flush'.  Markers without a timestamp get the time
+    they were received.  Pending datagrams are read in batches and passed to
+    callback as a list of Markers.
+    """
+
+    MAX_BATCH = 256
+    MAX_SIZE = 1024
+
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise ValueError('exists and is not a socket')
+            # left over from a previous run
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(path)
+        self._watch = GLib.io_add_watch(self.sock.fileno(), GLib.PRIORITY_DEFAULT,
+                                        GLib.IOCondition.IN, self._drain)
+
+    def close(self):
+        GLib.source_remove(self._watch)
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _drain(self, fd, condition):
+        markers = []
+        for n in range(self.MAX_BATCH):
+            try:
+                msg = self.sock.recv(self.MAX_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            markers.append(self.parse(msg))
+        if markers:
+            self.callback(markers)
+        return True
+
+    @staticmethod
+    def parse(msg, now=None):
+        label = msg.decode('UTF-8', 'replace').strip()
+        if label.startswith('@'):
+            timestamp, sep, rest = label[1:].partition(' ')
+            try:
+                timestamp = float(timestamp)
+            except ValueError:
+                pass
+            else:
+                if math.isfinite(timestamp):
+                    return Marker(timestamp, rest.strip())
+        return Marker(time.time() if now is None else now, label)
+
+
+def send_marker(path, label, timestamp=None):
+    """Send an event marker to a MarkerChannel listening on path.
+
+    Never blocks: if nobody is listening, or the receiver is falling behind,
+    the marker is dropped and False is returned.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    msg = '@{!r} {}'.format(timestamp, label).encode('UTF-8')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(msg, socket.MSG_DONTWAIT, path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+class Recorder(object):
+    """Write samples and event markers of one process to a recording.
+
+    A recording is a file starting with a short header followed by
+    fixed-size little-endian (time, virt, rss) records of doubles, so it can
+    be read back with mmap and binary searched by time without parsing it
+    (see Recording).  Markers go to a text file next to it, named
+    <recording>.markers, one tab-separated time and label per line.
+    """
+
+    MAGIC = b'memgraph\x01\x00\x00\x00\x00\x00\x00\x00'
+    RECORD = struct.Struct('<ddd')
+
+    def __init__(self, path):
+        self.path = path
+        # unbuffered, so a recording survives memgraphinator being killed
+        self.f = open(path, 'wb', buffering=0)
+        self.f.write(self.MAGIC)
+        self.markers_f = None
+        try:
+            # don't mix in markers of an older recording with the same name
+            os.unlink(path + '.markers')
+        except FileNotFoundError:
+            pass
+
+    def add(self, timestamp, value):
+        self.f.write(self.RECORD.pack(timestamp, value.virt, value.rss))
+
+    def add_markers(self, markers):
+        if self.markers_f is None:
+            self.markers_f = open(self.path + '.markers', 'w')
+        for marker in markers:
+            self.markers_f.write('{!r}\t{}\n'.format(
+                marker.time, marker.label.replace('\n', ' ')))
+        self.markers_f.flush()
+
+    def close(self):
+        self.f.close()
+        if self.markers_f is not None:
+            self.markers_f.close()
+
+
+class Recording(object):
+    """Read-only view of a recording written by Recorder.
+
+    times, virt and rss are memoryviews into the mmapped file, so even
+    recordings with millions of samples don't get loaded into memory.
+
+    Like Graph's Peaks, a pyramid of RSS maxima over blocks of BLOCK,
+    2 * BLOCK, 4 * BLOCK, ... samples is built when the recording is opened,
+    so peak_between() can find the biggest value in any stretch of the
+    recording without looking at every sample in it.
+    """
+
+    BLOCK = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            header = f.read(len(Recorder.MAGIC))
+            if header != Recorder.MAGIC:
+                raise ValueError('%s: not a memgraphinator recording' % path)
+            if sys.byteorder != 'little':
+                # the columns are read in place with memoryview.cast()
+                raise ValueError('%s: recordings are little-endian and can'
+                                 ' only be read on little-endian machines'
+                                 % path)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # ignore a partial record at the end, if we crashed while writing it
+        n = (len(self._mmap) - len(header)) // Recorder.RECORD.size
+        if not n:
+            raise ValueError('%s: recording is empty' % path)
+        view = memoryview(self._mmap)[len(header):]
+        view = view[:n * Recorder.RECORD.size].cast('d')
+        self.times = view[0::3]
+        self.virt = view[1::3]
+        self.rss = view[2::3]
+        self.start = self.times[0]
+        self.end = self.times[-1]
+        self._build_peaks()
+        self.peak_rss = self._peaks[-1][0]
+        self.markers = self._load_markers(path + '.markers')
+
+    def __len__(self):
+        return len(self.times)
+
+    def _load_markers(self, path):
+        markers = []
+        try:
+            with open(path) as f:
+                for line in f:
+                    timestamp, sep, label = line.rstrip('\n').partition('\t')
+                    try:
+                        timestamp = float(timestamp)
+                    except ValueError:
+                        continue
+                    if math.isfinite(timestamp):
+                        markers.append(Marker(timestamp, label))
+        except IOError:
+            pass
+        return sorted(markers)
+
+    def find_marker(self, label):
+        for marker in self.markers:
+            if marker.label == label:
+                return marker.time
+        return None
+
+    def _build_peaks(self):
+        rss = self.rss
+        B = self.BLOCK
+        level = array.array('d', (max(rss[i:i + B])
+                                  for i in range(0, len(rss), B)))
+        self._peaks = [level]
+        while len(level) > 1:
+            level = array.array('d', (max(level[i:i + 2])
+                                      for i in range(0, len(level), 2)))
+            self._peaks.append(level)
+
+    def peak_between(self, start, end):
+        """Biggest RSS in effect at any time in [start, end), or None."""
+        if end <= self.start or start > self.end:
+            return None
+        # the sample taken at or before start is still in effect then
+        i = max(0, bisect.bisect_right(self.times, start) - 1)
+        j = max(i + 1, bisect.bisect_left(self.times, end))
+        return self._max(i, j)
+
+    def _max(self, i, j):
+        # raw samples up to the first whole block and after the last one,
+        # and the biggest pyramid blocks that fit in between
+        B = self.BLOCK
+        b0 = -(-i // B)
+        b1 = j // B
+        if b0 >= b1:
+            return max(self.rss[i:j])
+        parts = []
+        if i < b0 * B:
+            parts.append(max(self.rss[i:b0 * B]))
+        if b1 * B < j:
+            parts.append(max(self.rss[b1 * B:j]))
+        while b0 < b1:
+            k = 0
+            while (k + 1 < len(self._peaks) and b0 % (2 << k) == 0
+                   and b0 + (2 << k) <= b1):
+                k += 1
+            parts.append(self._peaks[k][b0 >> k])
+            b0 += 1 << k
+        return max(parts)
+
+
 def format_size(size):
     return '{:,} MB'.format(size // 1024)
 
 
+def format_rate(rate):
+    return '{:+,.2f} MB/s'.format(rate / 1024)
+
+
 def format_time_ago(seconds):
     if seconds < 60:
         return '%d seconds ago' % seconds
@@ -76,6 +408,52 @@ def format_time_ago(seconds):
         return '%d hours, %d minutes, %d seconds ago' % (h, m, s)
 
 
+class Peaks(object):
+    """Running maxima of samples over fixed time buckets.
+
+    Level k has buckets of size * 2**k seconds, aligned to absolute time,
+    and keeps the time of the last sample and the biggest VIRT and RSS in
+    each bucket.  This lets Graph draw any zoom level from a few buckets per
+    pixel column instead of looking at every sample.
+    """
+
+    LEVELS = 16
+
+    def __init__(self, size):
+        self.size = size
+        # each level is (keys, times, virt, rss)
+        self.levels = [([], [], [], []) for k in range(self.LEVELS)]
+
+    def add(self, timestamp, value):
+        size = self.size
+        for keys, times, virt, rss in self.levels:
+            key = timestamp // size
+            if keys and keys[-1] == key:
+                times[-1] = timestamp
+                virt[-1] = max(virt[-1], value.virt)
+                rss[-1] = max(rss[-1], value.rss)
+            else:
+                keys.append(key)
+                times.append(timestamp)
+                virt.append(value.virt)
+                rss.append(value.rss)
+            size *= 2
+
+    def copy(self):
+        peaks = Peaks(self.size)
+        peaks.levels = [tuple(list(column) for column in level)
+                        for level in self.levels]
+        return peaks
+
+    def level(self, scale):
+        """Return (times, virt, rss) with buckets no bigger than scale."""
+        k = 0
+        if scale > self.size:
+            k = min(self.LEVELS - 1, int(math.floor(math.log2(scale / self.size))))
+        keys, times, virt, rss = self.levels[k]
+        return times, virt, rss
+
+
 class Graph(Gtk.DrawingArea):
 
     # color stolen from virt-manager
@@ -88,6 +466,7 @@ class Graph(Gtk.DrawingArea):
     RSS_FILL = (0.89453125, 0.71484375, 0.84765625, .5)
     RSS_FILL_PAUSED = (0.8627451, 0.854902, 0.945098, .5)
     SELECTION_COLOR = (0.75, 0.75, 0.75, 0.5)
+    MARKER_COLOR = (0.9, 0.5, 0.1)
 
     interval = GObject.Property(
         type=int, default=100, minimum=1, nick='Update interval (ms)')
@@ -99,11 +478,17 @@ class Graph(Gtk.DrawingArea):
     def __init__(self):
         super(Graph, self).__init__()
         self.time = None
+        self.times = []
         self.data = []
+        self.peaks = Peaks(self.interval * 0.001)
         self.peak = 1
+        self.peak_rss = 0
+        self.markers = []
         self._paused = False
         self._terminated = False
+        self.visible_times = self.times
         self.visible_data = self.data
+        self.visible_peaks = self.peaks
         self.visible_time = None
         self.visible_peak = None
         self.cur_pos = None
@@ -114,6 +499,7 @@ class Graph(Gtk.DrawingArea):
                         Gdk.EventMask.LEAVE_NOTIFY_MASK |
                         Gdk.EventMask.BUTTON_PRESS_MASK)
         self.connect('notify::zoom', lambda *a: self.queue_draw())
+        self.connect('notify::interval', self._rebuild_peaks)
 
     @GObject.Property(type=float, nick='Time (time_t) value under pointer')
     def cur_time(self):
@@ -152,22 +538,43 @@ class Graph(Gtk.DrawingArea):
         if new_value != self._paused:
             self._paused = new_value
             if self._paused:
+                self.visible_times = list(self.times)
                 self.visible_data = list(self.data)
+                self.visible_peaks = self.peaks.copy()
             else:
+                self.visible_times = self.times
                 self.visible_data = self.data
+                self.visible_peaks = self.peaks
                 self.visible_time = self.time
             self.queue_draw()
 
     def add_point(self, value):
         if value is not None:
             self.time = time.time()
+            self.times.append(self.time)
             self.data.append(value)
+            self.peaks.add(self.time, value)
             self.peak = max(self.peak, value.virt)
+            self.peak_rss = max(self.peak_rss, value.rss)
             if not self.paused:
                 self.visible_time = self.time
                 self.visible_peak = self.peak
                 self.queue_draw()
 
+    def _rebuild_peaks(self, *args):
+        # one Peaks level 0 bucket is one pixel at zoom level 1
+        self.peaks = Peaks(self.interval * 0.001)
+        for timestamp, value in zip(self.times, self.data):
+            self.peaks.add(timestamp, value)
+        self.visible_peaks = self.peaks.copy() if self.paused else self.peaks
+        self.queue_draw()
+
+    def add_markers(self, markers):
+        self.markers.extend(markers)
+        self.markers.sort()
+        if not self.paused:
+            self.queue_draw()
+
     def do_motion_notify_event(self, event):
         self.cur_pos = event.x, event.y
         self.queue_draw()
@@ -223,15 +630,16 @@ class Graph(Gtk.DrawingArea):
             rss_color, rss_fill = self.RSS_COLOR, self.RSS_FILL
 
         # draw the graph from right to left, discarding data if it no longer fits
-        dx = 1 / self.zoom
+        scale = self.zoom * self.interval * 0.001  # seconds per pixel
         dy = float(max(1, h - 10)) / self.visible_peak
-        n = min(len(self.visible_data), int(w * self.zoom + 1))
+        times, virt, rss = self.visible_peaks.level(scale)
+        first = bisect.bisect_left(times, self.visible_time - w * scale)
+        first = max(0, first - 1)
 
         cr.set_line_width(1)
 
         # VIRT
-        virt_points = self._points(w - n * dx + 1, h, dx, -dy, self.visible_data[-n:],
-                                   MemoryUsage._fields.index('virt'))
+        virt_points = self._points(w, h, scale, -dy, times, virt, first)
         cr.set_source_rgba(*virt_fill)
         self._polygon(cr, virt_points, h)
         cr.fill()
@@ -240,8 +648,7 @@ class Graph(Gtk.DrawingArea):
         cr.stroke()
 
         # RSS
-        rss_points = self._points(w - n * dx + 1, h, dx, -dy, self.visible_data[-n:],
-                                  MemoryUsage._fields.index('rss'))
+        rss_points = self._points(w, h, scale, -dy, times, rss, first)
         cr.set_source_rgba(*rss_fill)
         self._polygon(cr, rss_points, h)
         cr.fill()
@@ -249,21 +656,35 @@ class Graph(Gtk.DrawingArea):
         self._line(cr, rss_points)
         cr.stroke()
 
+        # Event markers
+        if self.markers and self.visible_time:
+            self._draw_markers(cr, w, h)
+
         # Current position
         if self.cur_pos:
             self._draw_cur_pos(cr, h)
         if self.cur_pos and self.visible_time:
             x, y = self.cur_pos
             distance_from_right = (w - x)
-            time = (
-                self.visible_time
-                - distance_from_right * self.zoom * self.interval * 0.001
-            )
-            idx = -int(round((distance_from_right + 1) * self.zoom))
-            if not -n <= idx < 0:
+            time = self.visible_time - distance_from_right * scale
+            idx = bisect.bisect_right(self.visible_times, time) - 1
+            # several samples under the pointer: show the peak that _points()
+            # drew for this column
+            column = math.floor(x)
+            column_start = self.visible_time - (w - column) * scale
+            column_end = column_start + scale
+            i = bisect.bisect_left(times, column_start)
+            j = bisect.bisect_left(times, column_end)
+            samples = (bisect.bisect_left(self.visible_times, column_end)
+                       - bisect.bisect_left(self.visible_times, column_start))
+            if samples > 1 and j > i:
+                value = MemoryUsage(max(virt[i:j]), max(rss[i:j]))
+                x = column
+            elif idx < 0:
                 value = MemoryUsage.invalid
             else:
                 value = self.visible_data[idx]
+            if value != MemoryUsage.invalid:
                 cr.set_source_rgb(*virt_color)
                 cr.arc(x + 0.5, h - value.virt * dy, 2, 0, 2 * math.pi)
                 cr.fill()
@@ -272,11 +693,43 @@ class Graph(Gtk.DrawingArea):
                 cr.fill()
             self._set_cur_time_value(time, value)
 
-    def _points(self, x0, y0, dx, dy, data, idx):
+    def _draw_markers(self, cr, w, h):
+        scale = self.zoom * self.interval * 0.001  # seconds per pixel
+        first = bisect.bisect_left(self.markers, (self.visible_time - w * scale,))
+        cr.set_font_size(9)
+        for marker in self.markers[first:]:
+            if marker.time > self.visible_time:
+                break
+            x = int(w - (self.visible_time - marker.time) / scale) + 0.5
+            cr.set_source_rgb(*self.MARKER_COLOR)
+            cr.set_dash([3, 2])
+            cr.move_to(x, 0)
+            cr.line_to(x, h)
+            cr.stroke()
+            cr.set_dash([])
+            cr.move_to(x + 2, 10)
+            cr.show_text(marker.label)
+
+    def _points(self, w, y0, scale, dy, times, values, first):
+        # Samples needn't be evenly spaced (see ProcessGraph.adaptive), so
+        # walk the pixel columns that have samples in them.  times and values
+        # come from Peaks buckets no bigger than a column, so short bursts
+        # don't disappear when zoomed out, and there are never more than a
+        # few buckets in a column.
+        right = self.visible_time
         pts = []
-        step = max(1, int(1 / dx))
-        for i in range(0, len(data), step):
-            pts.append((x0 + i * dx, y0 + data[i][idx] * dy))
+        i = first
+        n = len(times)
+        while i < n:
+            x = w - (right - times[i]) / scale
+            column = math.floor(x)
+            next_column_time = right - (w - column - 1) * scale
+            j = bisect.bisect_left(times, next_column_time, i + 1)
+            if j == i + 1:
+                pts.append((x, y0 + values[i] * dy))
+            else:
+                pts.append((column + 0.5, y0 + max(values[i:j]) * dy))
+            i = j
         return pts
 
     def _line(self, cr, points):
@@ -292,12 +745,149 @@ class Graph(Gtk.DrawingArea):
         cr.line_to(points[0][0], h)
 
 
+class BreakdownGraph(Gtk.DrawingArea):
+    """Stacked area graph of RSS split up by mapping kind (see SmapsReader).
+
+    Shares the time axis of a Graph, so the two line up, and freezes when
+    that graph is paused.
+    """
+
+    COLORS = [
+        (0.73046875, 0.421875, 0.640625),
+        (0.421875, 0.640625, 0.73046875),
+        (0.421875, 0.73046875, 0.4705882),
+        (0.89453125, 0.71484375, 0.421875),
+        (0.640625, 0.73046875, 0.421875),
+        (0.4705882, 0.421875, 0.73046875),
+        (0.73046875, 0.4705882, 0.421875),
+    ]
+    REST_COLOR = (0.75, 0.75, 0.75)
+    REST = '(everything else)'
+
+    def __init__(self, graph):
+        super(BreakdownGraph, self).__init__()
+        self.graph = graph
+        self.times = []
+        self.data = []
+        self.peak = 1
+        self.set_size_request(50, 50)
+        for prop in 'zoom', 'paused':
+            graph.connect('notify::' + prop, lambda *a: self.queue_draw())
+
+    def add_sample(self, totals, timestamp=None):
+        if totals is not None:
+            self.times.append(time.time() if timestamp is None else timestamp)
+            self.data.append(totals)
+            self.peak = max(self.peak, sum(totals.values()))
+            self.queue_draw()
+
+    def do_draw(self, cr):
+        cr.save()
+        self._draw(cr)
+        cr.restore()
+
+    def _draw(self, cr):
+        window = self.get_window()
+        w = window.get_width()
+        h = window.get_height()
+
+        # white background
+        cr.set_source_rgb(1, 1, 1)
+        cr.rectangle(0, 0, w, h)
+        cr.fill()
+
+        right = self.graph.visible_time
+        if right is None:
+            return
+        scale = self.graph.interval * 0.001 * self.graph.zoom  # seconds/pixel
+        first = max(0, bisect.bisect_left(self.times, right - w * scale) - 1)
+        last = bisect.bisect_right(self.times, right)
+        if last - first < 1:
+            return
+
+        # biggest groups go at the bottom; lump the small fry together
+        latest = self.data[last - 1]
+        if not latest:
+            return
+        groups = sorted(latest, key=latest.get, reverse=True)
+        if len(groups) > len(self.COLORS):
+            groups = groups[:len(self.COLORS) - 1] + [self.REST]
+        colors = list(self.COLORS[:len(groups)])
+        if groups[-1] == self.REST:
+            colors[-1] = self.REST_COLOR
+        xs = [w - (right - self.times[i]) / scale for i in range(first, last)]
+        stacks = [self._stack(self.data[i], groups) for i in range(first, last)]
+        dy = float(max(1, h - 10)) / self.peak
+
+        # paint cumulative sums top down, each one covering the next
+        for n in range(len(groups) - 1, -1, -1):
+            points = [(x, h - stack[n] * dy) for x, stack in zip(xs, stacks)]
+            cr.set_source_rgb(*colors[n])
+            self.graph._polygon(cr, points, h)
+            cr.fill()
+
+        # legend
+        cr.set_font_size(10)
+        y = 12
+        for group, color, size in zip(groups, colors, self._split(latest, groups)):
+            cr.set_source_rgb(*color)
+            cr.rectangle(4, y - 8, 8, 8)
+            cr.fill()
+            cr.set_source_rgb(0, 0, 0)
+            cr.move_to(16, y)
+            cr.show_text('{} {}'.format(group, format_size(size)))
+            y += 12
+
+    def _split(self, values, groups):
+        split = [values.get(group, 0) for group in groups]
+        if groups[-1] == self.REST:
+            split[-1] = sum(values.values()) - sum(split[:-1])
+        return split
+
+    def _stack(self, values, groups):
+        stack = []
+        total = 0
+        for value in self._split(values, groups):
+            total += value
+            stack.append(total)
+        return stack
+
+
 class ProcessGraph(Gtk.VBox):
 
+    # reading /proc/PID/smaps is much more expensive than /proc/PID/status
+    SMAPS_INTERVAL = 2000  # ms
+    # and for processes with lots of mappings, read it even less often, so
+    # the worker thread spends at most 1/SMAPS_BACKOFF of its time on it
+    SMAPS_BACKOFF = 20
+
     zoom = GObject.Property(
         type=float, default=1.0, minimum=1.0, nick='Zoom factor',
         blurb='Scale factor for zooming out the horizontal (time) axis')
 
+    adaptive = GObject.Property(
+        type=bool, default=False, nick='Adaptive sampling',
+        blurb='Sample faster when memory usage changes quickly, and slower'
+              ' when it stays the same')
+
+    min_interval = GObject.Property(
+        type=int, default=5, minimum=1, nick='Minimum update interval (ms)',
+        blurb='Shortest interval between samples in adaptive mode')
+
+    max_interval = GObject.Property(
+        type=int, default=1000, minimum=1, nick='Maximum update interval (ms)',
+        blurb='Longest interval between samples in adaptive mode')
+
+    threshold = GObject.Property(
+        type=int, default=1024, minimum=1, nick='Change threshold (KB)',
+        blurb='In adaptive mode sample as fast as possible when RSS or VIRT'
+              ' change by this much from one sample to the next')
+
+    level = GObject.Property(
+        type=int, default=0, minimum=0, nick='Alert level (KB)',
+        blurb='In adaptive mode sample as fast as possible when RSS or VIRT'
+              ' cross this level (0 means no level)')
+
     def __init__(self):
         super(ProcessGraph, self).__init__(spacing=2)
         self.label = Gtk.Label(label='Process', xalign=0,
@@ -319,6 +909,9 @@ class ProcessGraph(Gtk.VBox):
         self.size_label = Gtk.Label(label='', xalign=1.0)
         b.pack_end(self.size_label, True, True, 0)
         self.pack_start(b, False, False, 0)
+        self.breakdown = None
+        self.recorder = None
+        self._smaps_reader = None
         self._pid = None
         self._interval = 100
         self._stop = False
@@ -351,11 +944,101 @@ class ProcessGraph(Gtk.VBox):
 
     def stop(self):
         self._stop = True
+        self._stop_recording()
+
+    def record(self, path):
+        """Save samples and markers to a recording (see Recorder)."""
+        self._stop_recording()
+        self.recorder = Recorder(path)
+
+    def _stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def show_breakdown(self, group_by='category'):
+        """Show memory usage by mapping kind below the graph."""
+        self.hide_breakdown()
+        self.breakdown = BreakdownGraph(self.graph)
+        f = Gtk.Frame()
+        f.add(self.breakdown)
+        f.show_all()
+        self.pack_start(f, True, True, 0)
+        self.reorder_child(f, 2)
+        self._smaps_reader = SmapsReader(self.pid, group_by)
+        self._poll_smaps(self._smaps_reader)
+
+    def hide_breakdown(self):
+        if self.breakdown is not None:
+            self.remove(self.breakdown.get_parent())
+            self.breakdown = None
+            self._smaps_reader = None
+
+    def _poll_smaps(self, reader):
+        if self._stop or self.graph.terminated or reader is not self._smaps_reader:
+            return False
+        # a big smaps takes a while to read, don't block the main loop on it
+        thread = threading.Thread(target=self._read_smaps, args=(reader,))
+        thread.daemon = True
+        thread.start()
+        return False
+
+    def _read_smaps(self, reader):
+        # runs in a worker thread: leave the widgets to _smaps_read()
+        start = time.time()
+        totals = reader.read()
+        end = time.time()
+        GLib.idle_add(self._smaps_read, reader, totals, end, end - start)
+
+    def _smaps_read(self, reader, totals, timestamp, cost):
+        if reader is not self._smaps_reader:
+            return False
+        self.breakdown.add_sample(totals, timestamp)
+        interval = max(self.SMAPS_INTERVAL,
+                       int(cost * 1000 * self.SMAPS_BACKOFF))
+        GLib.timeout_add(interval, self._poll_smaps, reader)
+        return False
 
     def _start_polling(self):
         self._start_polling = lambda: None  # don't do this again
-        self._poll()
-        GLib.timeout_add(self.interval, self._poll)
+        if self.adaptive:
+            self._next_interval = self.interval
+            self._poll_adaptive()
+        else:
+            self._poll()
+            GLib.timeout_add(self.interval, self._poll)
+
+    def _poll_adaptive(self):
+        if self._poll():
+            self._next_interval = self._adapt_interval(self._next_interval)
+            GLib.timeout_add(self._next_interval, self._poll_adaptive)
+        return False
+
+    def _adapt_interval(self, interval):
+        """Pick the next sampling interval (ms) for adaptive mode.
+
+        Jump to min_interval as soon as RSS or VIRT move by threshold from
+        one sample to the next (however far apart they are), or cross level.
+        Otherwise aim for at most half of threshold of change per sample, but
+        never more than double the interval at a time.
+        """
+        times = self.graph.times
+        data = self.graph.data
+        if len(data) >= 2:
+            prev, cur = data[-2], data[-1]
+            elapsed = (times[-1] - times[-2]) * 1000
+            change = max(abs(cur.rss - prev.rss), abs(cur.virt - prev.virt))
+            crossed = self.level and (
+                (prev.rss < self.level) != (cur.rss < self.level) or
+                (prev.virt < self.level) != (cur.virt < self.level))
+            if change >= self.threshold or crossed:
+                interval = self.min_interval
+            elif change:
+                interval = min(2 * interval,
+                               elapsed * self.threshold / (2 * change))
+            else:
+                interval = 2 * interval
+        return int(max(self.min_interval, min(self.max_interval, interval)))
 
     def _poll(self):
         if self._stop:
@@ -363,11 +1046,16 @@ class ProcessGraph(Gtk.VBox):
         value = get_mem_usage(self.pid)
         if value is None:
             self.graph.add_point(MemoryUsage.zero)
+            if self.recorder is not None:
+                self.recorder.add(self.graph.time, MemoryUsage.zero)
+                self._stop_recording()
             self.graph.terminated = True
             self.notify('alive')
             return False
         else:
             self.graph.add_point(value)
+            if self.recorder is not None:
+                self.recorder.add(self.graph.time, value)
             self.size_label.set_label('{} / {}'.format(
                 format_size(value.rss), format_size(value.virt)))
             return True
@@ -375,6 +1063,25 @@ class ProcessGraph(Gtk.VBox):
     def add_point(self, value):
         self.graph.add_point(value)
 
+    def add_markers(self, markers):
+        self.graph.add_markers(markers)
+        if self.recorder is not None:
+            self.recorder.add_markers(markers)
+
+    def growth_rate(self, seconds=10):
+        """Return the RSS growth rate (KB/s) over the last few seconds."""
+        times = self.graph.times
+        data = self.graph.data
+        if len(data) < 2:
+            return 0.0
+        i = max(0, bisect.bisect_left(times, times[-1] - seconds))
+        if i == len(data) - 1:
+            i -= 1
+        elapsed = times[-1] - times[i]
+        if elapsed <= 0:
+            return 0.0
+        return (data[-1].rss - data[i].rss) / elapsed
+
     def cur_value_changed(self, *args):
         if self.graph.cur_time == -1 or self.graph.visible_time is None:
             self.cur_value_label.set_label('')
@@ -409,17 +1116,450 @@ def _framed(widget):
     return frame
 
 
+class Sparkline(Gtk.CellRenderer):
+    """Cell renderer that draws the recent RSS history of a ProcessGraph."""
+
+    WIDTH = 160
+    HEIGHT = 24
+
+    graph = GObject.Property(type=object, nick='ProcessGraph to draw')
+
+    def __init__(self):
+        super(Sparkline, self).__init__()
+        self.set_fixed_size(self.WIDTH, self.HEIGHT)
+
+    def do_render(self, cr, widget, background_area, cell_area, flags):
+        if self.graph is None:
+            return
+        graph = self.graph.graph
+        x0 = cell_area.x + self.get_property('xpad')
+        y0 = cell_area.y + self.get_property('ypad')
+        w = cell_area.width - 2 * self.get_property('xpad')
+        h = cell_area.height - 2 * self.get_property('ypad')
+        # pick one sample per pixel column, never copy the whole history
+        times = graph.times
+        data = graph.data
+        if len(data) < 2 or not graph.peak_rss:
+            return
+        scale = graph.zoom * graph.interval * 0.001  # seconds per pixel
+        dy = float(h) / graph.peak_rss
+        points = []
+        for x in range(w):
+            i = bisect.bisect_right(times, times[-1] - (w - 1 - x) * scale) - 1
+            if i >= 0:
+                points.append((x0 + x, y0 + h - data[i].rss * dy))
+        if len(points) < 2:
+            return
+        if graph.paused:
+            color, fill = graph.RSS_COLOR_PAUSED, graph.RSS_FILL_PAUSED
+        else:
+            color, fill = graph.RSS_COLOR, graph.RSS_FILL
+        cr.save()
+        cr.set_line_width(1)
+        cr.set_source_rgba(*fill)
+        graph._polygon(cr, points, y0 + h)
+        cr.fill()
+        cr.set_source_rgb(*color)
+        graph._line(cr, points)
+        cr.stroke()
+        cr.restore()
+
+
+class ProcessOverview(Gtk.TreeView):
+    """Compact sortable list of many ProcessGraphs, one sparkline per row.
+
+    Gtk.TreeView only renders the rows that are scrolled into view, and in
+    fixed height mode it doesn't need to measure the others either, so this
+    scales to hundreds of processes where a stack of ProcessGraphs doesn't.
+    """
+
+    REFRESH_INTERVAL = 1000  # ms
+
+    class Column:
+        types = (int, str, int, str, float, str, int, str, object)
+        (PID, COMMAND, RSS, RSS_TEXT, GROWTH, GROWTH_TEXT, PEAK, PEAK_TEXT,
+         GRAPH) = range(len(types))
+
+    def __init__(self):
+        self.store = Gtk.ListStore(*self.Column.types)
+        self.sort_model = Gtk.TreeModelSort(model=self.store)
+        self.sort_model.set_sort_column_id(self.Column.RSS,
+                                           Gtk.SortType.DESCENDING)
+        super(ProcessOverview, self).__init__(model=self.sort_model)
+        self.set_search_column(self.Column.COMMAND)
+        self._add_column("PID", self.Column.PID, self.Column.PID, 60,
+                         xalign=1.0)
+        self._add_column("Command", self.Column.COMMAND, self.Column.COMMAND,
+                         200, ellipsize=Pango.EllipsizeMode.END).set_expand(True)
+        self._add_column("RSS", self.Column.RSS_TEXT, self.Column.RSS, 90,
+                         xalign=1.0)
+        self._add_column("Growth", self.Column.GROWTH_TEXT, self.Column.GROWTH,
+                         100, xalign=1.0)
+        self._add_column("Peak", self.Column.PEAK_TEXT, self.Column.PEAK, 90,
+                         xalign=1.0)
+        column = Gtk.TreeViewColumn("History", Sparkline(),
+                                    graph=self.Column.GRAPH)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_fixed_width(Sparkline.WIDTH)
+        self.append_column(column)
+        self.set_fixed_height_mode(True)
+        self.set_activate_on_single_click(True)
+        GLib.timeout_add(self.REFRESH_INTERVAL, self._refresh)
+
+    def _add_column(self, title, text_column, sort_column, width, **kwargs):
+        column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(**kwargs),
+                                    text=text_column)
+        column.set_sort_column_id(sort_column)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_fixed_width(width)
+        self.append_column(column)
+        return column
+
+    def add_graph(self, graph):
+        self.store.append([graph.pid, graph.label.get_label(), 0, '', 0.0, '',
+                           0, '', graph])
+
+    def remove_graph(self, graph):
+        for row in self.store:
+            if row[self.Column.GRAPH] is graph:
+                self.store.remove(row.iter)
+                break
+
+    def get_graph(self, path):
+        return self.sort_model[path][self.Column.GRAPH]
+
+    def refresh(self):
+        C = self.Column
+        for row in self.store:
+            graph = row[C.GRAPH]
+            data = graph.graph.data
+            rss = data[-1].rss if data else 0
+            growth = graph.growth_rate()
+            peak = graph.graph.peak_rss
+            # avoid needless row-changed signals (and re-sorting)
+            if (row[C.RSS], row[C.GROWTH], row[C.PEAK]) != (rss, growth, peak):
+                self.store.set(row.iter,
+                               [C.RSS, C.RSS_TEXT, C.GROWTH, C.GROWTH_TEXT,
+                                C.PEAK, C.PEAK_TEXT],
+                               [rss, format_size(rss), growth,
+                                format_rate(growth), peak, format_size(peak)])
+        # sparklines change even when the numbers don't
+        self.queue_draw()
+
+    def _refresh(self):
+        if self.get_mapped():
+            self.refresh()
+        return True
+
+
+class ComparisonGraph(Gtk.DrawingArea):
+    """RSS of several recordings on the same time axis, plus B - A.
+
+    The recordings are aligned according to an alignment spec:
+
+    - 'start': on the first sample of each recording
+    - 'marker:LABEL': on the first marker with that label in each recording
+      (recordings without one are aligned on their start)
+    - 'offset:SECONDS': on their starts, with each recording after the first
+      shifted right by SECONDS
+
+    All series are resampled onto one time base: the biggest value in each
+    pixel column, looked up with Recording.peak_between(), so short spikes
+    don't disappear when zoomed out, and drawing takes time proportional to
+    the window width, not to the length of the recordings.  B - A is the
+    difference of those per-column peaks.
+    Scroll to zoom, drag to pan.
+    """
+
+    COLORS = BreakdownGraph.COLORS
+    DIFF_COLOR = (0, 0, 0)
+    AXIS_COLOR = (0.75, 0.75, 0.75)
+    SELECTION_COLOR = Graph.SELECTION_COLOR
+    ZOOM_STEP = 1.25
+
+    status = GObject.Property(type=str, default='', nick='Value under pointer')
+
+    def __init__(self, recordings, alignment='start'):
+        super(ComparisonGraph, self).__init__()
+        self.recordings = recordings
+        self.shifts = [rec.start for rec in recordings]
+        self.peak = max(1, max(rec.peak_rss for rec in recordings))
+        self.t0 = None  # aligned time at the left edge
+        self.spp = None  # seconds per pixel
+        self.cur_pos = None
+        self._drag = None
+        self.set_size_request(100, 100)
+        self.add_events(Gdk.EventMask.POINTER_MOTION_MASK |
+                        Gdk.EventMask.LEAVE_NOTIFY_MASK |
+                        Gdk.EventMask.BUTTON_PRESS_MASK |
+                        Gdk.EventMask.BUTTON_RELEASE_MASK |
+                        Gdk.EventMask.SCROLL_MASK)
+        self.align(alignment)
+
+    @staticmethod
+    def parse_alignment(alignment):
+        """Split an alignment spec into (mode, argument), or raise ValueError."""
+        mode, sep, arg = alignment.partition(':')
+        if mode == 'start' and not sep:
+            return mode, None
+        if mode == 'marker' and arg:
+            return mode, arg
+        if mode == 'offset':
+            try:
+                offset = float(arg)
+            except ValueError:
+                pass
+            else:
+                if math.isfinite(offset):
+                    return mode, offset
+        raise ValueError('bad alignment: %s (expected start, marker:LABEL'
+                         ' or offset:SECONDS)' % alignment)
+
+    def align(self, alignment):
+        mode, arg = self.parse_alignment(alignment)
+        if mode == 'start':
+            self.shifts = [rec.start for rec in self.recordings]
+        elif mode == 'marker':
+            found = [rec.find_marker(arg) for rec in self.recordings]
+            if all(t is None for t in found):
+                raise ValueError('no recording has a marker called "%s"' % arg)
+            self.shifts = [rec.start if t is None else t
+                           for rec, t in zip(self.recordings, found)]
+        elif mode == 'offset':
+            self.shifts = [rec.start - (arg if n else 0)
+                           for n, rec in enumerate(self.recordings)]
+        self.zoom_to_fit()
+
+    def zoom_to_fit(self):
+        self.t0 = self.spp = None  # figured out in _draw(), once we know w
+        self.queue_draw()
+
+    def do_scroll_event(self, event):
+        if self.spp is None:
+            return False
+        if event.direction == Gdk.ScrollDirection.UP:
+            factor = 1 / self.ZOOM_STEP
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            factor = self.ZOOM_STEP
+        else:
+            return False
+        t = self.t0 + event.x * self.spp
+        self.spp *= factor
+        self.t0 = t - event.x * self.spp
+        self.queue_draw()
+        return True
+
+    def do_button_press_event(self, event):
+        if event.button == Gdk.BUTTON_PRIMARY and self.spp is not None:
+            self._drag = event.x, self.t0
+            return True
+
+    def do_button_release_event(self, event):
+        if event.button == Gdk.BUTTON_PRIMARY:
+            self._drag = None
+            return True
+
+    def do_motion_notify_event(self, event):
+        self.cur_pos = event.x, event.y
+        if self._drag is not None:
+            x, t0 = self._drag
+            self.t0 = t0 - (event.x - x) * self.spp
+        self.queue_draw()
+
+    def do_leave_notify_event(self, event):
+        self.cur_pos = None
+        self.status = ''
+        self.queue_draw()
+
+    def do_draw(self, cr):
+        cr.save()
+        self._draw(cr)
+        cr.restore()
+
+    def _draw(self, cr):
+        window = self.get_window()
+        w = window.get_width()
+        h = window.get_height()
+
+        # white background
+        cr.set_source_rgb(1, 1, 1)
+        cr.rectangle(0, 0, w, h)
+        cr.fill()
+
+        if self.spp is None:
+            t0 = min(rec.start - shift
+                     for rec, shift in zip(self.recordings, self.shifts))
+            t1 = max(rec.end - shift
+                     for rec, shift in zip(self.recordings, self.shifts))
+            self.t0 = t0
+            self.spp = max(t1 - t0, 1.0) / max(1, w - 1)
+
+        diff = len(self.recordings) > 1
+        top_h = h * 2 // 3 if diff else h
+        dy = float(max(1, top_h - 10)) / self.peak
+
+        # the overlaid RSS series
+        cr.set_line_width(1)
+        series = [self._resample(rec, shift, w)
+                  for rec, shift in zip(self.recordings, self.shifts)]
+        colors = [self.COLORS[n % len(self.COLORS)] for n in range(len(series))]
+        for values, color in zip(series, colors):
+            points = [(x + 0.5, top_h - v * dy) for x, v in enumerate(values)
+                      if v is not None]
+            if points:
+                cr.set_source_rgb(*color)
+                self._line(cr, points)
+                cr.stroke()
+
+        # B - A
+        if diff:
+            a, b = series[:2]
+            deltas = [vb - va if va is not None and vb is not None else None
+                      for va, vb in zip(a, b)]
+            limit = max([abs(d) for d in deltas if d is not None] or [0]) or 1
+            mid = top_h + (h - top_h) // 2
+            ddy = float(max(1, (h - top_h) // 2 - 5)) / limit
+            cr.set_source_rgb(*self.AXIS_COLOR)
+            cr.move_to(0, top_h + 0.5)
+            cr.line_to(w, top_h + 0.5)
+            cr.move_to(0, mid + 0.5)
+            cr.line_to(w, mid + 0.5)
+            cr.stroke()
+            points = [(x + 0.5, mid - d * ddy) for x, d in enumerate(deltas)
+                      if d is not None]
+            if points:
+                cr.set_source_rgb(*self.DIFF_COLOR)
+                self._line(cr, points)
+                cr.stroke()
+
+        # legend
+        cr.set_font_size(10)
+        y = 12
+        names = [rec.name for rec in self.recordings]
+        if diff:
+            names.append('{} - {}'.format(names[1], names[0]))
+        for name, color in zip(names, colors + [self.DIFF_COLOR]):
+            cr.set_source_rgb(*color)
+            cr.move_to(4, y)
+            cr.show_text(name)
+            y += 12
+
+        # current position
+        if self.cur_pos:
+            x = int(self.cur_pos[0])
+            cr.set_source_rgba(*self.SELECTION_COLOR)
+            cr.move_to(x + 0.5, 0)
+            cr.line_to(x + 0.5, h)
+            cr.stroke()
+            if 0 <= x < w:
+                values = [v[x] for v in series]
+                text = ['{:+.1f} s'.format(self.t0 + x * self.spp)]
+                text += ['{} {}'.format(name, format_size(int(v)))
+                         for name, v in zip(names, values) if v is not None]
+                if diff and deltas[x] is not None:
+                    text.append('diff {:+,} MB'.format(int(deltas[x]) // 1024))
+                self.status = ', '.join(text)
+
+    def _resample(self, rec, shift, w):
+        """Return peak RSS of rec in each pixel column (None where there's no data)."""
+        t = self.t0 + shift
+        spp = self.spp
+        return [rec.peak_between(t + x * spp, t + (x + 1) * spp)
+                for x in range(w)]
+
+    def _line(self, cr, points):
+        cr.move_to(*points[0])
+        for x, y in points[1:]:
+            cr.line_to(x, y)
+
+
+class ComparisonWindow(Gtk.Window):
+    """Window for comparing recordings side by side."""
+
+    def __init__(self, recordings, alignment='start', parent=None):
+        super(ComparisonWindow, self).__init__(transient_for=parent)
+        if parent is None:
+            self.connect("delete-event", Gtk.main_quit)
+        self.set_default_size(600, 350)
+        self.set_border_width(6)
+
+        hb = Gtk.HeaderBar()
+        hb.set_show_close_button(True)
+        hb.set_title("Compare recordings")
+        hb.set_subtitle(', '.join(rec.name for rec in recordings))
+        self.set_titlebar(hb)
+
+        self.graph = ComparisonGraph(recordings, alignment)
+
+        self.align_combo = Gtk.ComboBoxText()
+        self.align_combo.append('start', 'Align on process start')
+        labels = set()
+        for rec in recordings:
+            labels.update(marker.label for marker in rec.markers)
+        for label in sorted(labels):
+            self.align_combo.append('marker:' + label,
+                                    'Align on marker "%s"' % label)
+        self.align_combo.append('offset', 'Shift by')
+        self.offset_button = Gtk.SpinButton.new_with_range(-1e6, 1e6, 0.1)
+        self.offset_button.set_digits(1)
+        self.offset_button.set_tooltip_text(
+            "Seconds to shift the second and later recordings by")
+        mode, arg = ComparisonGraph.parse_alignment(alignment)
+        if mode == 'offset':
+            self.offset_button.set_value(arg)
+            alignment = 'offset'
+        if not self.align_combo.set_active_id(alignment):
+            raise ValueError('bad alignment: %s' % alignment)
+        self.align_combo.connect("changed", self.alignment_changed)
+        self.offset_button.connect("value-changed", self.alignment_changed)
+        hb.pack_start(self.align_combo)
+        hb.pack_start(self.offset_button)
+
+        button = Gtk.Button.new_from_icon_name(
+            "zoom-fit-best-symbolic", Gtk.IconSize.BUTTON)
+        button.connect("clicked", lambda *a: self.graph.zoom_to_fit())
+        hb.pack_end(button)
+
+        self.status_label = Gtk.Label(label='', xalign=0.0,
+                                      ellipsize=Pango.EllipsizeMode.END)
+        self.graph.bind_property("status", self.status_label, "label")
+
+        vbox = Gtk.VBox(spacing=2)
+        vbox.pack_start(_framed(self.graph), True, True, 0)
+        vbox.pack_start(self.status_label, False, False, 0)
+        self.add(vbox)
+        self.alignment_changed()
+
+    def alignment_changed(self, *args):
+        alignment = self.align_combo.get_active_id() or 'start'
+        self.offset_button.set_sensitive(alignment == 'offset')
+        if alignment == 'offset':
+            alignment = 'offset:%s' % self.offset_button.get_value()
+        self.graph.align(alignment)
+
+
 class MainWindow(Gtk.Window):
 
+    # switch to the overview automatically when watching more processes
+    OVERVIEW_THRESHOLD = 20
+
     zoom = GObject.Property(
         type=float, default=1.0, minimum=1.0, nick='Zoom factor',
         blurb='Scale factor for zooming out the horizontal (time) axis')
 
-    def __init__(self, exit_when_process_dies=False):
+    def __init__(self, exit_when_process_dies=False, breakdown=None,
+                 record=None, sampling=None):
         super(MainWindow, self).__init__()
 
         self.exit_when_process_dies = exit_when_process_dies
+        self.breakdown = breakdown
+        self.record = record
+        # ProcessGraph property values, e.g. {'adaptive': True}
+        self.sampling = sampling or {}
         self.graphs = []
+        self.markers = []
+        self.expanded = []
+        self._overview = False
 
         self.connect("delete-event", Gtk.main_quit)
         self.set_default_size(400, 250)
@@ -434,6 +1574,20 @@ class MainWindow(Gtk.Window):
         button.connect("clicked", self.select_process)
         hb.pack_start(button)
 
+        button = Gtk.Button.new_from_icon_name("document-open-symbolic",
+                                               Gtk.IconSize.BUTTON)
+        button.set_tooltip_text("Compare recordings")
+        button.connect("clicked", self.open_recordings)
+        hb.pack_start(button)
+
+        self.overview_button = Gtk.ToggleButton()
+        self.overview_button.add(Gtk.Image.new_from_icon_name(
+            "view-list-symbolic", Gtk.IconSize.BUTTON))
+        self.overview_button.set_tooltip_text("Overview")
+        self.overview_button.bind_property(
+            "active", self, "overview", GObject.BindingFlags.BIDIRECTIONAL)
+        hb.pack_start(self.overview_button)
+
         box = Gtk.HBox()
         box.get_style_context().add_class("linked")
 
@@ -457,24 +1611,86 @@ class MainWindow(Gtk.Window):
 
         self.vbox = Gtk.VBox()
         self.vbox.add(self.select_button)
-        w = Gtk.ScrolledWindow()
-        w.add(self.vbox)
-        self.add(w)
+        self.graphs_pane = Gtk.ScrolledWindow()
+        self.graphs_pane.add(self.vbox)
+
+        self.overview_list = ProcessOverview()
+        self.overview_list.connect("row-activated", self.expand_graph)
+        self.overview_list.connect("button-press-event",
+                                   self.show_overview_popup)
+        self.overview_pane = _framed(_scrollable(self.overview_list))
+
+        # visibility of the panes is managed by _repack_graphs()
+        for pane in self.overview_pane, self.graphs_pane:
+            pane.show_all()
+            pane.set_no_show_all(True)
+        self.overview_pane.hide()
+
+        paned = Gtk.Paned(orientation=Gtk.Orientation.VERTICAL)
+        paned.pack1(self.overview_pane, True, False)
+        paned.pack2(self.graphs_pane, True, True)
+        self.add(paned)
 
         self.graph_popup = Gtk.Menu()
         remove_graph = Gtk.MenuItem.new_with_mnemonic(label="_Remove")
         remove_graph.connect("activate", self.remove_graph)
         self.graph_popup.append(remove_graph)
+        self.breakdown_item = Gtk.CheckMenuItem.new_with_mnemonic(
+            label="Memory _breakdown")
+        self.breakdown_item.connect("toggled", self.toggle_breakdown)
+        self.graph_popup.append(self.breakdown_item)
         self.graph_popup.show_all()
 
+    @GObject.Property(type=bool, default=False, nick='Overview mode')
+    def overview(self):
+        return self._overview
+
+    @overview.setter
+    def overview(self, new_value):
+        if new_value != self._overview:
+            self._overview = new_value
+            self._repack_graphs()
+
+    def _repack_graphs(self):
+        """Show all graphs, or only the expanded ones in overview mode."""
+        for child in self.vbox.get_children():
+            self.vbox.remove(child)
+        if not self.graphs:
+            self.vbox.add(self.select_button)
+            self.select_button.show_all()
+        for graph in self.graphs:
+            if not self.overview or graph in self.expanded:
+                self.vbox.add(graph)
+        self.overview_pane.set_visible(self.overview and bool(self.graphs))
+        self.graphs_pane.set_visible(
+            not self.overview or not self.graphs or bool(self.expanded))
+
+    def expand_graph(self, treeview, path, column):
+        graph = self.overview_list.get_graph(path)
+        if graph in self.expanded:
+            self.expanded.remove(graph)
+        else:
+            self.expanded.append(graph)
+        self._repack_graphs()
+
     def watch_pid(self, pid, start_from_zero=False):
         graph = ProcessGraph()
         graph.connect('notify::alive', self.process_exited)
         graph.zoom = self.zoom
         self.bind_property("zoom", graph, "zoom")
+        for name, value in self.sampling.items():
+            setattr(graph, name, value)
         if start_from_zero:
             graph.add_point(MemoryUsage.zero)
+        if self.record:
+            path = self.record
+            if '{pid}' not in path and self.graphs:
+                path += '.{pid}'
+            graph.record(path.replace('{pid}', str(pid)))
+        graph.add_markers(self.markers)
         graph.pid = pid
+        if self.breakdown:
+            graph.show_breakdown(self.breakdown)
         graph.connect("button-press-event", self.show_graph_popup)
         graph.show_all()
 
@@ -488,6 +1704,14 @@ class MainWindow(Gtk.Window):
             grow = True
 
         self.graphs.append(graph)
+        self.overview_list.add_graph(graph)
+
+        if len(self.graphs) > self.OVERVIEW_THRESHOLD:
+            self.overview = True
+        if self.overview:
+            self._repack_graphs()
+            return
+
         self.vbox.add(graph)
 
         if grow:
@@ -504,6 +1728,11 @@ class MainWindow(Gtk.Window):
                 h = min(mh, h + gh)
                 self.resize(w, h)
 
+    def add_markers(self, markers):
+        self.markers.extend(markers)
+        for graph in self.graphs:
+            graph.add_markers(markers)
+
     def get_min_height(self):
         return 250
 
@@ -531,29 +1760,72 @@ class MainWindow(Gtk.Window):
                 self.watch_pid(pid)
         process_selector_dialog.destroy()
 
+    def open_recordings(self, target):
+        dialog = Gtk.FileChooserDialog(
+            title="Compare recordings", transient_for=self,
+            action=Gtk.FileChooserAction.OPEN, select_multiple=True)
+        dialog.add_button("Cancel", Gtk.ResponseType.CANCEL)
+        dialog.add_button("Open", Gtk.ResponseType.OK)
+        if dialog.run() == Gtk.ResponseType.OK:
+            paths = dialog.get_filenames()
+        else:
+            paths = []
+        dialog.destroy()
+        if not paths:
+            return
+        try:
+            recordings = [Recording(path) for path in paths]
+        except (IOError, ValueError) as e:
+            error = Gtk.MessageDialog(
+                transient_for=self, message_type=Gtk.MessageType.ERROR,
+                buttons=Gtk.ButtonsType.CLOSE, text=str(e))
+            error.run()
+            error.destroy()
+            return
+        ComparisonWindow(recordings, parent=self).show_all()
+
     def process_exited(self, *args):
         if self.exit_when_process_dies:
             if not any(g.alive for g in self.graphs):
                 Gtk.main_quit()
 
+    def show_overview_popup(self, treeview, event):
+        if event.button == Gdk.BUTTON_SECONDARY:
+            hit = treeview.get_path_at_pos(int(event.x), int(event.y))
+            if hit is not None:
+                return self.show_graph_popup(treeview.get_graph(hit[0]), event)
+
     def show_graph_popup(self, widget, event):
         if event.button == Gdk.BUTTON_SECONDARY:
             self.graph_popup.selected_graph = widget
+            self.breakdown_item.handler_block_by_func(self.toggle_breakdown)
+            self.breakdown_item.set_active(widget.breakdown is not None)
+            self.breakdown_item.handler_unblock_by_func(self.toggle_breakdown)
             self.graph_popup.popup_at_pointer(event)
             return True
 
+    def toggle_breakdown(self, item):
+        graph = self.graph_popup.selected_graph
+        if item.get_active():
+            graph.show_breakdown(self.breakdown or 'category')
+        else:
+            graph.hide_breakdown()
+
     def remove_graph(self, action):
         graph = self.graph_popup.selected_graph
         self.graph_popup.selected_graph = None
         graph.stop()
         self.graphs.remove(graph)
-        self.vbox.remove(graph)
+        self.overview_list.remove_graph(graph)
+        if graph in self.expanded:
+            self.expanded.remove(graph)
         if not self.graphs:
-            self.vbox.add(self.select_button)
-            self.select_button.show_all()
             self.zoom_out_button.set_sensitive(False)
             self.zoom_in_button.set_sensitive(False)
+        if self.overview or not self.graphs:
+            self._repack_graphs()
         else:
+            self.vbox.remove(graph)
             w, h = self.get_size()
             # XXX: these hardcoded numbers are icky, how can I get gtk to
             # compute them for me?
@@ -713,6 +1985,9 @@ class ProcessSelector(Gtk.Dialog):
             self.store.append([pid, cmdline, size.virt, size_mb, mine])
 
 
+MARKERS_ENV = 'MEMGRAPHINATOR_MARKERS'
+
+
 def main():
     parser = argparse.ArgumentParser(description="Graph process memory usage")
     parser.add_argument('command', nargs='*',
@@ -723,7 +1998,74 @@ def main():
                         help='Watch the memory usage of memgraphinator itself')
     parser.add_argument('--exit-when-process-dies', action='store_true',
                         help='Exit when monitored process dies')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Sample faster while memory usage changes quickly'
+                             ' and slower while it stays the same')
+    parser.add_argument('--min-interval', type=int, default=5, metavar='MS',
+                        help='Shortest sampling interval with --adaptive'
+                             ' (default: %(default)s)')
+    parser.add_argument('--max-interval', type=int, default=1000, metavar='MS',
+                        help='Longest sampling interval with --adaptive'
+                             ' (default: %(default)s)')
+    parser.add_argument('--threshold', type=int, default=1024, metavar='KB',
+                        help='With --adaptive, sample as fast as possible when'
+                             ' RSS or VIRT change by this much from one'
+                             ' sample to the next, however far apart they'
+                             ' are (default: %(default)s)')
+    parser.add_argument('--level', type=int, default=0, metavar='KB',
+                        help='With --adaptive, also sample as fast as'
+                             ' possible when RSS or VIRT cross this level')
+    parser.add_argument('--breakdown', choices=['category', 'file'],
+                        help='Also graph memory usage by mapping category'
+                             ' or by mapped file, from /proc/PID/smaps')
+    parser.add_argument('--overview', action='store_true',
+                        help='Show a compact list of all monitored processes')
+    parser.add_argument('--markers', metavar='SOCKET',
+                        help='Listen for event markers on this Unix socket'
+                             ' (also passed to the command in $%s)' % MARKERS_ENV)
+    parser.add_argument('--record', metavar='FILENAME',
+                        help='Save the samples to a file; {pid} in the name'
+                             ' is replaced with the process ID (without'
+                             ' {pid}, recordings of the second and later'
+                             ' processes get .PID appended to the name)')
+    parser.add_argument('--compare', metavar='FILENAME', action='append',
+                        help='Show saved recordings on the same axes;'
+                             ' can be given more than once')
+    parser.add_argument('--align', default='start',
+                        help='How to line up recordings: start (default),'
+                             ' marker:LABEL or offset:SECONDS')
+    parser.add_argument('--mark', metavar='LABEL',
+                        help='Send an event marker to a running'
+                             ' memgraphinator and exit')
     args = parser.parse_args()
+    if args.adaptive and not 1 <= args.min_interval <= args.max_interval:
+        parser.error('need 1 <= --min-interval <= --max-interval')
+    if args.mark is not None:
+        path = args.markers or os.environ.get(MARKERS_ENV)
+        if not path:
+            sys.exit("--mark needs --markers or $%s" % MARKERS_ENV)
+        if not send_marker(path, args.mark):
+            sys.exit("%s: nobody is listening" % path)
+        return
+    if args.compare:
+        try:
+            mode, arg = ComparisonGraph.parse_alignment(args.align)
+        except ValueError as e:
+            parser.error(str(e))
+        try:
+            recordings = [Recording(path) for path in args.compare]
+            win = ComparisonWindow(recordings, args.align)
+        except (IOError, ValueError) as e:
+            sys.exit(str(e))
+        if mode == 'marker':
+            for rec in recordings:
+                if rec.find_marker(arg) is None:
+                    print('%s has no marker called "%s", aligning it on its'
+                          ' start' % (rec.name, arg), file=sys.stderr)
+        win.show_all()
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        Gtk.main()
+        return
     if args.command and all(arg.isdigit() for arg in args.command):
         if args.pid is None:
             args.pid = []
@@ -732,17 +2074,36 @@ def main():
 
     start_from_zero = False
     child = None
+    win = None
+    marker_channel = None
+    env = None
+    if args.markers:
+        try:
+            # win will exist by the time the main loop delivers any markers
+            marker_channel = MarkerChannel(
+                args.markers, lambda markers: win.add_markers(markers))
+        except (OSError, ValueError) as e:
+            sys.exit("%s: %s" % (args.markers, e))
+        env = dict(os.environ, **{MARKERS_ENV: args.markers})
     if args.command:
         start_from_zero = True
         try:
-            child = subprocess.Popen(args.command)
+            child = subprocess.Popen(args.command, env=env)
             pids = [child.pid]
         except OSError as e:
             sys.exit("%s: %s" % (args.command[0], e))
     else:
         pids = args.pid or []
+    sampling = {}
+    if args.adaptive:
+        sampling = dict(adaptive=True, min_interval=args.min_interval,
+                        max_interval=args.max_interval, threshold=args.threshold,
+                        level=args.level)
     try:
-        win = MainWindow(exit_when_process_dies=args.exit_when_process_dies)
+        win = MainWindow(exit_when_process_dies=args.exit_when_process_dies,
+                         breakdown=args.breakdown, record=args.record,
+                         sampling=sampling)
+        win.overview = args.overview
         if args.self:
             win.watch_pid(os.getpid(), start_from_zero=True)
         for pid in pids:
@@ -751,6 +2112,11 @@ def main():
         signal.signal(signal.SIGINT, signal.SIG_DFL)
         Gtk.main()
     finally:
+        if win is not None:
+            for graph in win.graphs:
+                graph.stop()
+        if marker_channel is not None:
+            marker_channel.close()
         if child and child.poll() is None:
             print("Killing child %d" % child.pid)
             child.terminate()